@@ -0,0 +1,243 @@
+#!/usr/bin/python3
+
+import io
+import os
+import json
+import time
+import shutil
+import threading
+import collections
+import urllib.parse
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from colorama import Fore, Back, Style
+from typing import Iterator
+from PIL import Image
+from googleapiclient.errors import HttpError
+from fileSystem import FileSystem
+from googleDriveApi import ID
+from slideshowEngine import SlideshowEngine, Slide, readEnv, readVideoFrames
+from envType import Env
+
+
+class CacheDaemon:
+    """
+    Serves ready slides to several slideshows over local HTTP.
+    All slideshows share one folder index, the downloaded files and one cache
+    of rendered images, independent of their root folder and screen size.
+    Downloads are shared while the files are on disk, the last
+    `PICTURE_KEEP_NR` shown files over all slideshows are kept.
+
+    `GET /slide?root=<folder ID>&width=<px>&height=<px>` answers with the
+    rendered image as JPEG, or the original file for videos. The slide
+    metadata is JSON in the `X-Slide` header.
+    """
+
+    __env: Env
+    __fileSystem: FileSystem
+    __log: collections.deque
+    __derivatives: collections.OrderedDict
+    # one engine per root folder, the screen size is passed per slide
+    __engines: dict[ID, SlideshowEngine]
+    # held while an engine is created, one per root folder
+    __engineLocks: dict[ID, threading.Lock]
+    __engineLocksLock: threading.Lock
+    # shared by all engines, guards log and derivatives
+    __lock: threading.Lock
+    __server: ThreadingHTTPServer
+
+    def __getEngine(self, rootFolderId: ID) -> SlideshowEngine:
+        with self.__engineLocksLock:
+            engineLock = self.__engineLocks.setdefault(rootFolderId, threading.Lock())
+        # slideshows of other root folders are not blocked while crawling
+        with engineLock:
+            engine = self.__engines.get(rootFolderId, None)
+            if engine is None:
+                print(f"daemon: new engine for '{rootFolderId}'")
+                engine = SlideshowEngine(
+                    {**self.__env, 'ROOT_FOLDER_ID': rootFolderId}, 1920, 1080,
+                    self.__fileSystem, self.__log, self.__derivatives, self.__lock)
+                self.__engines[rootFolderId] = engine
+        return engine
+
+    def nextSlide(self, rootFolderId: ID, width: int, height: int) -> tuple[dict, bytes, str]:
+        """ @return Slide metadata, body and content type of the response. """
+        slide = self.__getEngine(rootFolderId).nextSlide(width, height)
+        if slide['isVideo']:
+            # The file may already be evicted by other slideshows,
+            # the client retries then.
+            with open(slide['pathLocal'], 'rb') as f:
+                body = f.read()
+            contentType = slide['file']['mimeType']
+        else:
+            buffer = io.BytesIO()
+            slide['image'].convert('RGB').save(buffer, 'JPEG', quality=90)
+            body = buffer.getvalue()
+            contentType = 'image/jpeg'
+        metadata = {
+            'file': slide['file'],
+            'path': slide['path'],
+            'caption': slide['caption'],
+            'isVideo': slide['isVideo'],
+            'fps': slide['fps'],
+            'duration': slide['duration'],
+        }
+        return metadata, body, contentType
+
+    def serveForever(self) -> None:
+        print(Fore.GREEN + f'daemon: serving on {self.__server.server_address}' + Style.RESET_ALL)
+        self.__server.serve_forever()
+
+    def __init__(self, env: Env) -> None:
+        self.__env = env
+        self.__fileSystem = FileSystem(self.__env)
+        self.__log = collections.deque(maxlen=self.__env['PICTURE_KEEP_NR'])
+        self.__derivatives = collections.OrderedDict()
+        self.__engines = {}
+        self.__engineLocks = {}
+        self.__engineLocksLock = threading.Lock()
+        self.__lock = threading.Lock()
+
+        # clear and generate temp folder, engines share it
+        tempFolder = self.__env['PICTURE_TEMP_FOLDER']
+        if os.path.exists(tempFolder):
+            shutil.rmtree(tempFolder)
+        os.makedirs(tempFolder)
+
+        # only serve the local machine
+        self.__server = ThreadingHTTPServer(
+            ('127.0.0.1', self.__env['CACHE_SERVER_PORT']), _RequestHandler)
+        self.__server.cacheDaemon = self
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self) -> None:
+        url = urllib.parse.urlparse(self.path)
+        if url.path != '/slide':
+            self.send_error(404)
+            return
+        query = urllib.parse.parse_qs(url.query)
+        try:
+            rootFolderId = query['root'][0]
+            width = int(query['width'][0])
+            height = int(query['height'][0])
+        except (KeyError, ValueError):
+            self.send_error(400, 'root, width and height are required')
+            return
+
+        try:
+            metadata, body, contentType = self.server.cacheDaemon.nextSlide(
+                rootFolderId, width, height)
+        except HttpError as error:
+            # missing files are skipped by the engine, this is the root folder
+            print(Fore.RED + f'daemon: {error!r}' + Style.RESET_ALL)
+            self.send_error(404 if error.status_code == 404 else 500, type(error).__name__)
+            return
+        except Exception as error:
+            print(Fore.RED + f'daemon: {error!r}' + Style.RESET_ALL)
+            self.send_error(500, type(error).__name__)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('X-Slide', json.dumps(metadata))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class CacheDaemonClient:
+    """
+    Drop-in replacement for `SlideshowEngine` that gets its slides from a
+    running `CacheDaemon` at `CACHE_SERVER_URL`.
+    """
+
+    __env: Env
+    __width: int
+    __height: int
+    __videoPath: str
+
+    def __fetch(self) -> tuple[dict, bytes]:
+        """
+        Request the next slide, retry while the daemon is unreachable or
+        fails. Invalid requests are not retried.
+        """
+        query = urllib.parse.urlencode({
+            'root': self.__env['ROOT_FOLDER_ID'],
+            'width': self.__width,
+            'height': self.__height,
+        })
+        errors = 0
+        while True:
+            try:
+                with urllib.request.urlopen(f"{self.__env['CACHE_SERVER_URL']}/slide?{query}") as response:
+                    return json.loads(response.headers['X-Slide']), response.read()
+            except urllib.error.HTTPError as error:
+                # HTTPError is a URLError, check it first
+                errors += 1
+                if error.code < 500 or errors >= 10:
+                    raise error
+                print(f'client: cache daemon error ({error.code} {error.reason}), retrying')
+            except urllib.error.URLError as error:
+                errors += 1
+                if errors >= 10:
+                    raise error
+                print(f'client: cache daemon unreachable ({error.reason}), retrying')
+            time.sleep(3)
+
+    @property
+    def env(self) -> Env:
+        return self.__env
+
+    def setDisplaySize(self, width: int, height: int) -> None:
+        """ Set the size the next slides are rendered to. """
+        self.__width = width
+        self.__height = height
+
+    def nextSlide(self, prefetchNext=True) -> Slide:
+        """ @param prefetchNext: Ignored, the daemon decides about prefetching. """
+        print('Get next slide')
+        metadata, body = self.__fetch()
+        print(f"Got next slide: '{metadata['path']}'")
+
+        if metadata['isVideo']:
+            # OpenCV can only read videos from disk
+            if self.__videoPath is not None and os.path.exists(self.__videoPath):
+                os.remove(self.__videoPath)
+            _, fileExtension = os.path.splitext(metadata['file']['name'])
+            self.__videoPath = os.path.join(
+                self.__env['PICTURE_TEMP_FOLDER'], f'client-{os.getpid()}{fileExtension}')
+            with open(self.__videoPath, 'wb') as f:
+                f.write(body)
+            return Slide(pathLocal=self.__videoPath, image=None, **metadata)
+
+        image = Image.open(io.BytesIO(body))
+        image.load()
+        return Slide(pathLocal=None, image=image, **metadata)
+
+    def slides(self) -> Iterator[Slide]:
+        """ Endless stream of ready-to-display slides. """
+        while True:
+            yield self.nextSlide()
+
+    def videoFrames(self, slide: Slide) -> Iterator[Image.Image]:
+        """ Decode the frames of a video slide, rendered to display size. """
+        return readVideoFrames(slide['pathLocal'], self.__width, self.__height)
+
+    def __init__(self, env: Env, width: int, height: int) -> None:
+        self.__env = env
+        self.__width = width
+        self.__height = height
+        self.__videoPath = None
+        # The temp folder may be shared with a daemon on the same machine,
+        # don't clear it.
+        os.makedirs(self.__env['PICTURE_TEMP_FOLDER'], exist_ok=True)
+
+
+if __name__ == '__main__':
+    daemon = CacheDaemon(readEnv(daemon=True))
+    try:
+        daemon.serveForever()
+    except KeyboardInterrupt:
+        print('Cache daemon terminated.')
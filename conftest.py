@@ -0,0 +1,144 @@
+""" Test fixtures: a local aiohttp stub of the Drive API and fakes for the synchronous client. """
+import re
+import asyncio
+import threading
+import pytest
+from aiohttp import web
+from googleDriveApi import GoogleDriveApi, Node, ID
+from googleDriveApiAsync import GoogleDriveApiAsync
+
+
+def folderNode(id: ID) -> Node:
+    return {'id': id, 'name': id, 'mimeType': GoogleDriveApi.MIME_TYPE_FOLDER}
+
+
+def fileNode(id: ID, name: str, mimeType: str, md5Checksum: str, size=3) -> Node:
+    return {'id': id, 'name': name, 'mimeType': mimeType, 'size': size, 'md5Checksum': md5Checksum}
+
+
+# folder ID -> content, 'b1' has the same content as 'a1'
+TREE: dict[ID, list[Node]] = {
+    'root': [folderNode('A'), folderNode('B')],
+    'A': [fileNode('a1', 'a1.jpg', 'image/jpeg', 'h1'), folderNode('C')],
+    'C': [fileNode('c1', 'c1.png', 'image/png', 'h2'),
+          fileNode('c2', 'c2.pdf', 'application/pdf', 'h4'),
+          fileNode('c3', 'c3.jpg', 'image/jpeg', 'h5', size=50_000_000)],
+    'B': [fileNode('b1', 'b1.jpg', 'image/jpeg', 'h1'), fileNode('b2', 'b2.jpg', 'image/jpeg', 'h3')],
+}
+
+
+class FakeCredentials:
+    """ Stands in for `google.oauth2.credentials.Credentials`. """
+
+    def __init__(self, token: str) -> None:
+        self.token = token
+        self.valid = True
+        self.refreshes = 0
+
+    def refresh(self, request) -> None:
+        self.refreshes += 1
+        self.token = f'token-{self.refreshes}'
+
+
+class FakeGoogleDriveApi:
+    """ Stands in for the synchronous `GoogleDriveApi`, serves `TREE`. """
+
+    def __init__(self, credentials: FakeCredentials) -> None:
+        self.credentials = credentials
+        self.folderRequests: list[ID] = []
+
+    def getNode(self, nodeId: ID) -> Node:
+        return folderNode(nodeId)
+
+    def getFolderContent(self, folderId: ID) -> list[Node]:
+        self.folderRequests.append(folderId)
+        return [dict(node) for node in TREE[folderId]]
+
+
+class DriveStub:
+    """
+    Minimal Drive API serving `TREE`, two nodes per page.
+    Requests can be made to fail with scripted status codes.
+    """
+
+    PAGE_SIZE = 2
+
+    def __init__(self) -> None:
+        self.url: str = None
+        self.validToken = 'token-0'
+        # (status, reason) returned before answering normally
+        self.failures: list[tuple[int, str]] = []
+        # folders whose content is never found
+        self.broken: set[ID] = set()
+        self.requests = 0
+        self.folderRequests: list[ID] = []
+        self.downloads: list[ID] = []
+
+    def __check(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        if request.headers.get('Authorization') != f'Bearer {self.validToken}':
+            return web.Response(status=401)
+        if self.failures:
+            status, reason = self.failures.pop(0)
+            return web.json_response({'error': {'errors': [{'reason': reason}]}}, status=status)
+        return None
+
+    async def files(self, request: web.Request) -> web.Response:
+        error = self.__check(request)
+        if error is not None:
+            return error
+        folderId = re.match(r"'([^']+)' in parents", request.query['q']).group(1)
+        self.folderRequests.append(folderId)
+        if folderId in self.broken or folderId not in TREE:
+            return web.Response(status=404)
+        page = int(request.query.get('pageToken', 0))
+        nodes = [dict(node) for node in TREE[folderId][page:page + self.PAGE_SIZE]]
+        for node in nodes:
+            if 'size' in node:
+                # the API sends sizes as strings
+                node['size'] = str(node['size'])
+        response = {'files': nodes}
+        if page + self.PAGE_SIZE < len(TREE[folderId]):
+            response['nextPageToken'] = str(page + self.PAGE_SIZE)
+        return web.json_response(response)
+
+    async def file(self, request: web.Request) -> web.Response:
+        error = self.__check(request)
+        if error is not None:
+            return error
+        fileId = request.match_info['id']
+        if request.query.get('alt') == 'media':
+            self.downloads.append(fileId)
+            return web.Response(body=f'content-{fileId}'.encode())
+        return web.json_response(folderNode(fileId))
+
+    def env(self, **overrides) -> dict:
+        return {'DRIVE_ID': 'drive', 'DRIVE_API_URL': self.url, 'DRIVE_CONCURRENCY': 4, **overrides}
+
+
+@pytest.fixture(autouse=True)
+def noBackoff(monkeypatch):
+    """ Don't actually wait between retries. """
+    monkeypatch.setattr(GoogleDriveApiAsync, 'BACKOFF_BASE', 0)
+
+
+@pytest.fixture
+def drive():
+    """ `DriveStub` served from a background thread, so synchronous code can use it too. """
+    stub = DriveStub()
+    app = web.Application()
+    app.router.add_get('/files', stub.files)
+    app.router.add_get('/files/{id}', stub.file)
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, '127.0.0.1', 0).start())
+    host, port = runner.addresses[0][:2]
+    stub.url = f'http://{host}:{port}'
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield stub
+    asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
@@ -1,9 +1,12 @@
 import os
 import json
 import datetime
+import asyncio
+import threading
 from colorama import Fore, Back, Style
 from typing import TypedDict
 from googleDriveApi import GoogleDriveApi, Node, ID
+from googleDriveApiAsync import GoogleDriveApiAsync
 from envType import Env as Env
 
 
@@ -29,14 +32,19 @@ class FileSystem:
     Provides basic methods to interact with the filesystem.
     The actual files are on Google Drive.
     This class provides a caching system for folders and their content to avoid
-    repeated long query times or hitting the request limit. Files themselves are
-    not cached.
+    repeated long query times or hitting the request limit. Downloaded files are
+    reused until they are deleted with `deleteFile`.
     """
 
     __env: Env
     __googleDriveApi: GoogleDriveApi
 
     __cache: dict[ID, CacheEntry]
+    # guards the folder cache, reentrant since the public methods call each other
+    __lock: threading.RLock
+    # one lock per content key, held while a file is downloaded or deleted
+    __fileLocks: dict[str, threading.Lock]
+    __fileLocksLock: threading.Lock
 
     def __writeBackCache(self) -> None:
         """Write back cache."""
@@ -44,25 +52,42 @@ def __writeBackCache(self) -> None:
             # there are no circular references by design
             json.dump(self.__cache, f, check_circular=False)
 
+    @staticmethod
+    def contentKey(file: File) -> str:
+        """
+        Identifies the content of a file, equal for copies of the same file.
+        Falls back to the ID for files without checksum (e.g. Google Docs).
+        """
+        return file.get('md5Checksum', file['id'])
+
+    def __fileLock(self, file: File) -> threading.Lock:
+        with self.__fileLocksLock:
+            return self.__fileLocks.setdefault(FileSystem.contentKey(file), threading.Lock())
+
     def __buildDiskFilePath(self, file: File) -> str:
+        # one copy per content, shared by all duplicates
         _, fileExtension = os.path.splitext(file['name'])
-        return self.__env['PICTURE_TEMP_FOLDER'] + '/' + file['id'] + fileExtension
+        return self.__env['PICTURE_TEMP_FOLDER'] + '/' + FileSystem.contentKey(file) + fileExtension
 
     def getFile(self, file: File) -> str:
         """
-        Gets the path to a file on disk. The file is downloaded. No caching.
+        Gets the path to a file on disk. The file is downloaded unless it is still on disk.
         @param file: The file we want.
         @return Path to file on disk.
         """
         path = self.__buildDiskFilePath(file)
-        self.__googleDriveApi.downloadFile(file['id'], path)
+        # wait for other threads downloading the same content
+        with self.__fileLock(file):
+            if not os.path.exists(path):
+                self.__googleDriveApi.downloadFile(file['id'], path)
         return path
 
     def deleteFile(self, file: File):
         """ @param file: The file to delete. """
         path = self.__buildDiskFilePath(file)
         try:
-            os.remove(path)
+            with self.__fileLock(file):
+                os.remove(path)
         except FileNotFoundError:
             # file already deleted
             # This can happen if the same image is shown twice. Then it is deleted
@@ -87,35 +112,56 @@ def getFolder(self, folder: Folder, forceUpdate=False, skipStore=False) -> Folde
         """
         folderId = folder['id']
 
+        with self.__lock:
+            cached = self.__lookupCache(folder, forceUpdate)
+            if cached is not None:
+                return cached
+            name = self.__googleDriveApi.getNode(folderId)['name']
+            nodes = self.__googleDriveApi.getFolderContent(folderId)
+            return self.__storeFolder(folderId, name, nodes, skipStore)
+
+    async def __getFolderAsync(self, api: GoogleDriveApiAsync, folder: Folder, forceUpdate: bool) -> Folder:
+        """ Like `getFolder`, but fetches through the async client and never writes back. """
+        folderId = folder['id']
+
+        cached = self.__lookupCache(folder, forceUpdate)
+        if cached is not None:
+            return cached
+        node, nodes = await asyncio.gather(
+            api.getNode(folderId), api.getFolderContent(folderId))
+        return self.__storeFolder(folderId, node['name'], nodes, skipStore=True)
+
+    def __lookupCache(self, folder: Folder, forceUpdate: bool) -> Folder:
+        """ @return Cached folder or None on a miss, stale value or forced update. """
         # query cache
-        item = self.__cache.get(folderId, None)
+        item = self.__cache.get(folder['id'], None)
         # no miss, no force update, not stale
-        if item is not None and not forceUpdate and datetime.datetime.utcnow() - datetime.datetime.fromisoformat(item['time']) < datetime.timedelta(days=self.__env['CACHE_RETENTION']):
+        if item is not None and not forceUpdate and datetime.datetime.utcnow() - datetime.datetime.fromisoformat(item['time']) < datetime.timedelta(hours=self.__env['CACHE_RETENTION']):
             # cache hit
-            folder = self.__cache[folderId]['folder']
+            folder = item['folder']
             print("  cache: hit  '{0}'".format(folder['name']))
             return folder
-        else:
-            # cache miss, stale value or forced update
-            print("  cache: miss '{0}'".format(folder['name']))
-            name = self.__googleDriveApi.getNode(folderId)['name']
-            nodes = self.__googleDriveApi.getFolderContent(folderId)
-            folder = Folder(
-                id=folderId,
-                name=name,
-                nrFolders=sum(
-                    1 for node in nodes if node['mimeType'] == GoogleDriveApi.MIME_TYPE_FOLDER),
-                nrFiles=sum(
-                    1 for node in nodes if node['mimeType'] != GoogleDriveApi.MIME_TYPE_FOLDER),
-                nodes=nodes
-            )
-            self.__cache[folderId] = CacheEntry(
-                time=datetime.datetime.utcnow().isoformat(timespec='seconds'),
-                folder=folder
-            )
-            if not skipStore:
-                self.__writeBackCache()
-            return folder
+        # cache miss, stale value or forced update
+        print("  cache: miss '{0}'".format(folder['name']))
+        return None
+
+    def __storeFolder(self, folderId: ID, name: str, nodes: list[Node], skipStore: bool) -> Folder:
+        folder = Folder(
+            id=folderId,
+            name=name,
+            nrFolders=sum(
+                1 for node in nodes if node['mimeType'] == GoogleDriveApi.MIME_TYPE_FOLDER),
+            nrFiles=sum(
+                1 for node in nodes if node['mimeType'] != GoogleDriveApi.MIME_TYPE_FOLDER),
+            nodes=nodes
+        )
+        self.__cache[folderId] = CacheEntry(
+            time=datetime.datetime.utcnow().isoformat(timespec='seconds'),
+            folder=folder
+        )
+        if not skipStore:
+            self.__writeBackCache()
+        return folder
 
     @staticmethod
     def filterNodes(nodes: list[Node], folders=True, files=True) -> list[Node]:
@@ -138,29 +184,101 @@ def filterNodes(nodes: list[Node], folders=True, files=True) -> list[Node]:
             # Programmer fucked up.
             raise ValueError("Cannot return neither files nor folders.")
 
-    def __forceInitializeRec(self, currentFolder: Folder, forceUpdate: bool) -> None:
-        for i, folderNode in enumerate(FileSystem.filterNodes(currentFolder['nodes'], True, False)):
-            # Skip store in most cases.
-            # This is a balance of not wasting a lot of time on continuously
-            # writing back cache vs. not losing a lot of progress in the event
-            # of a crash.
-            skipStore = i % 5 != 0
-            folder = self.getFolder(folderNode, forceUpdate, skipStore)
-            self.__forceInitializeRec(folder, forceUpdate)
+    def indexFolder(self, folder: Folder, path: str, seen: set[str], accept=None) -> list[tuple[File, str]]:
+        """
+        Recursively list all files in folder whose content was not seen before.
+        Subfolders are read with `getFolder`.
+
+        @param folder: Folder to index.
+        @param path: Path of folder.
+        @param seen: Content keys of already indexed files, updated in place.
+        @param accept: Only list files it returns True for, all by default.
+        @return Files and their paths.
+        """
+        files = []
+        for file in FileSystem.filterNodes(folder['nodes'], False, True):
+            if accept is not None and not accept(file):
+                continue
+            key = FileSystem.contentKey(file)
+            if key not in seen:
+                seen.add(key)
+                files.append((file, path + "/" + file['name']))
+        for nextNode in FileSystem.filterNodes(folder['nodes'], True, False):
+            nextFolder = self.getFolder(nextNode)
+            files.extend(self.indexFolder(nextFolder, path + "/" + nextFolder['name'], seen, accept))
+        return files
+
+    async def __forceInitializeAsync(self, rootFolder: Folder, forceUpdate: bool) -> None:
+        """ Crawl the tree breadth first, all folders of one level concurrently. """
+        async with GoogleDriveApiAsync(self.__env, self.__googleDriveApi.credentials) as api:
+            level = [await self.__getFolderAsync(api, rootFolder, False)]
+            while level:
+                folderNodes = [folderNode for folder in level
+                               for folderNode in FileSystem.filterNodes(folder['nodes'], True, False)]
+                results = await asyncio.gather(
+                    *(self.__getFolderAsync(api, folderNode, forceUpdate) for folderNode in folderNodes),
+                    return_exceptions=True)
+                level = []
+                for folderNode, result in zip(folderNodes, results):
+                    if isinstance(result, Exception):
+                        # Skip this subtree, it is fetched again on its next access.
+                        print(Fore.RED + "cache: crawling '{0}' failed ({1!r})".format(
+                            folderNode['name'], result) + Style.RESET_ALL)
+                    else:
+                        level.append(result)
+                # Write back once per level.
+                # This is a balance of not wasting a lot of time on continuously
+                # writing back cache vs. not losing a lot of progress in the event
+                # of a crash.
+                self.__writeBackCache()
 
     def forceInitialize(self, rootFolder: Folder, forceUpdate=False) -> None:
         """ Recursively access all folders to put everything into cache. """
         print(Fore.RED + "cache: FORCE INITIALIZE" + Style.RESET_ALL)
-        topLevelFolder = self.getFolder(rootFolder)
-        self.__forceInitializeRec(topLevelFolder, forceUpdate)
-        # Explicit write back, since we are skipping it sometimes in the
-        # recursive function.
-        self.__writeBackCache()
+        with self.__lock:
+            asyncio.run(self.__forceInitializeAsync(rootFolder, forceUpdate))
         print(Fore.RED + "cache: force initialize completed" + Style.RESET_ALL)
 
-    def __init__(self, env: Env) -> None:
+    async def __prefetchFilesAsync(self, files: list[File]) -> None:
+        # Duplicates share one path on disk, download it only once. Two
+        # downloads into the same `.part` file would break each other.
+        unique = {self.__buildDiskFilePath(file): file for file in files}
+        async with GoogleDriveApiAsync(self.__env, self.__googleDriveApi.credentials) as api:
+            await asyncio.gather(
+                *(api.downloadFile(file['id'], path) for path, file in unique.items()
+                  if not os.path.exists(path)))
+
+    def prefetchFiles(self, files: list[File]) -> list[str]:
+        """
+        Download several files concurrently, like `getFile`.
+        Files another thread is downloading already are skipped.
+        @param files: The files we want.
+        @return Paths to the files on disk, in the same order.
+        """
+        locks = []
+        pending = []
+        try:
+            for file in files:
+                lock = self.__fileLock(file)
+                if lock.acquire(blocking=False):
+                    locks.append(lock)
+                    pending.append(file)
+            asyncio.run(self.__prefetchFilesAsync(pending))
+        finally:
+            for lock in locks:
+                lock.release()
+        return [self.__buildDiskFilePath(file) for file in files]
+
+    def __init__(self, env: Env, googleDriveApi: GoogleDriveApi = None) -> None:
+        """
+        @param env: Environment.
+        @param googleDriveApi: Client to use, created from env by default.
+        """
         self.__env = env
-        self.__googleDriveApi = GoogleDriveApi(self.__env)
+        self.__googleDriveApi = GoogleDriveApi(self.__env) if googleDriveApi is None else googleDriveApi
+        self.__lock = threading.RLock()
+        self.__fileLocks = {}
+        self.__fileLocksLock = threading.Lock()
 
         self.__cache = {}
         if os.path.exists(self.__env['CACHE_FILE']):
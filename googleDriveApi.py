@@ -1,5 +1,6 @@
 from __future__ import print_function
 import os
+import threading
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
@@ -20,6 +21,7 @@ class Node(TypedDict):
     name: str
     mimeType: str
     size: int # size in bytes, absent for folders
+    md5Checksum: str # MD5 of the content, absent for folders and Google Docs
 
 
 class GoogleDriveApi:
@@ -30,7 +32,8 @@ class GoogleDriveApi:
 
     __env: Env
     __credentials: Credentials
-    __service: any
+    # the underlying HTTP client is not thread safe, one service per thread
+    __threadLocal: threading.local
 
     MIME_TYPE_FOLDER: str = 'application/vnd.google-apps.folder'
 
@@ -64,6 +67,23 @@ def __authenticate(self) -> None:
                 f.write(credentials.to_json())
         self.__credentials = credentials
 
+    @property
+    def __service(self) -> any:
+        service = getattr(self.__threadLocal, 'service', None)
+        if service is None:
+            try:
+                service = build(
+                    'drive', 'v3', credentials=self.__credentials)
+            except MutualTLSChannelError as error:
+                raise error
+            self.__threadLocal.service = service
+        return service
+
+    @property
+    def credentials(self) -> Credentials:
+        """ Credentials in use, allows sharing them with `GoogleDriveApiAsync`. """
+        return self.__credentials
+
     def downloadFile(self, fileId: ID, path: str) -> None:
         """
         Download a file.
@@ -73,12 +93,14 @@ def downloadFile(self, fileId: ID, path: str) -> None:
         """
         try:
             request = self.__service.files().get_media(fileId=fileId)
-            with open(path, 'w') as f:
+            # download next to the target, such that an existing `path` is always complete
+            with open(path + '.part', 'w') as f:
                 downloader = MediaIoBaseDownload(f.buffer, request)
                 done = False
                 while not done:
                     status, done = downloader.next_chunk()
                     print(f'  download {int(status.progress() * 100)}%')
+            os.replace(path + '.part', path)
         except HttpError as error:
             raise error
 
@@ -99,7 +121,7 @@ def getNode(self, nodeId: ID) -> Node:
 
     def getFolderContent(self, folderId: ID) -> list[Node]:
         QUERY_PARAMS: dict[str: any] = {
-            'fields': "nextPageToken, files(id, name, mimeType, size)",
+            'fields': "nextPageToken, files(id, name, mimeType, size, md5Checksum)",
             'pageSize': 40,  # not guaranteed to be respected by API
             'supportsAllDrives': True,  # specify that we handle shared drives
             'includeItemsFromAllDrives': True,  # specify that we handle shared drives
@@ -146,8 +168,6 @@ def __init__(self, env: Env) -> None:
         self.__env = env
 
         self.__authenticate()
-        try:
-            self.__service = build(
-                'drive', 'v3', credentials=self.__credentials)
-        except MutualTLSChannelError as error:
-            raise error
+        self.__threadLocal = threading.local()
+        # build the service of this thread right away to fail early
+        self.__service
@@ -0,0 +1,179 @@
+import os
+import asyncio
+import random
+import aiohttp
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from googleDriveApi import GoogleDriveApi, Node, ID
+from envType import Env
+
+
+class GoogleDriveApiAsync:
+    """
+    asyncio counterpart of `GoogleDriveApi` for crawling and downloading
+    many nodes concurrently.
+    Talks to the Drive REST API directly. All requests share one session,
+    one concurrency limit and one set of credentials, which are refreshed
+    at most once at a time.
+
+    Use as `async with GoogleDriveApiAsync(env, credentials) as api: ...`.
+    """
+
+    __env: Env
+    __credentials: Credentials
+    __baseUrl: str
+    __semaphore: asyncio.Semaphore
+    __refreshLock: asyncio.Lock
+    __session: aiohttp.ClientSession
+
+    MAX_RETRIES: int = 5
+    RETRY_STATUS: set[int] = {429, 500, 502, 503, 504}
+    # Drive also reports throttling as 403 with one of these reasons
+    RATE_LIMIT_REASONS: set[str] = {'rateLimitExceeded', 'userRateLimitExceeded'}
+    # seconds, the n-th retry waits about BACKOFF_BASE * 2^n
+    BACKOFF_BASE: float = 1
+    CHUNK_SIZE: int = 1 << 20
+
+    async def __isRetryable(self, response: aiohttp.ClientResponse) -> bool:
+        if response.status in self.RETRY_STATUS:
+            return True
+        if response.status == 403:
+            try:
+                error = await response.json(content_type=None)
+                reasons = {e.get('reason') for e in error['error']['errors']}
+            except (ValueError, KeyError, TypeError, aiohttp.ClientError):
+                return False
+            return not reasons.isdisjoint(self.RATE_LIMIT_REASONS)
+        return False
+
+    async def __refreshCredentials(self, rejectedToken: str = None) -> None:
+        """
+        Refresh the access token if it is invalid, shared by all requests.
+
+        @param rejectedToken: Token the API answered 401 to. Only refreshed if
+            no other request did so in the meantime.
+        """
+        async with self.__refreshLock:
+            if not self.__credentials.valid or (rejectedToken is not None and rejectedToken == self.__credentials.token):
+                # google-auth is synchronous, don't block the event loop
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self.__credentials.refresh, Request())
+
+    async def __request(self, path: str, params: dict[str: any], handle) -> any:
+        """
+        Perform a GET request with retry and exponential backoff.
+
+        @param path: Path relative to the API base URL.
+        @param params: Query parameters.
+        @param handle: Coroutine function that consumes the successful response.
+        """
+        attempt = 0
+        while True:
+            await self.__refreshCredentials()
+            token = self.__credentials.token
+            try:
+                async with self.__semaphore:
+                    async with self.__session.get(
+                            self.__baseUrl + path,
+                            params=params,
+                            headers={'Authorization': f'Bearer {token}'}) as response:
+                        if response.status == 401 and attempt < self.MAX_RETRIES:
+                            # token expired or revoked in the meantime,
+                            # no need to back off after refreshing it
+                            await self.__refreshCredentials(rejectedToken=token)
+                            attempt += 1
+                            continue
+                        elif attempt >= self.MAX_RETRIES or not await self.__isRetryable(response):
+                            response.raise_for_status()
+                            return await handle(response)
+                        else:
+                            print(f'  api: status {response.status}, retrying')
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as error:
+                if attempt >= self.MAX_RETRIES:
+                    raise error
+                print(f'  api: {type(error).__name__}, retrying')
+            # exponential backoff with jitter
+            await asyncio.sleep(self.BACKOFF_BASE * (2 ** attempt + random.random()))
+            attempt += 1
+
+    async def downloadFile(self, fileId: ID, path: str) -> None:
+        """
+        Download a file.
+
+        @param fileID Google Drive ID of file.
+        @param path Path to target location incl. file name on disk. Path must exist completely.
+        """
+        QUERY_PARAMS: dict[str: any] = {
+            'alt': 'media',
+            'supportsAllDrives': 'true',
+        }
+
+        async def handle(response: aiohttp.ClientResponse) -> None:
+            # see `GoogleDriveApi.downloadFile`
+            with open(path + '.part', 'wb') as f:
+                async for chunk in response.content.iter_chunked(self.CHUNK_SIZE):
+                    f.write(chunk)
+            os.replace(path + '.part', path)
+
+        await self.__request(f'/files/{fileId}', QUERY_PARAMS, handle)
+
+    async def getNode(self, nodeId: ID) -> Node:
+        QUERY_PARAMS: dict[str: any] = {
+            'fields': "id, name, mimeType",
+            'supportsAllDrives': 'true',  # specify that we handle shared drives
+        }
+
+        return await self.__request(f'/files/{nodeId}', QUERY_PARAMS, lambda r: r.json())
+
+    async def getFolderContent(self, folderId: ID) -> list[Node]:
+        QUERY_PARAMS: dict[str: any] = {
+            'q': f"'{folderId}' in parents and not trashed",
+            'fields': "nextPageToken, files(id, name, mimeType, size, md5Checksum)",
+            'pageSize': 40,  # not guaranteed to be respected by API
+            'supportsAllDrives': 'true',  # specify that we handle shared drives
+            'includeItemsFromAllDrives': 'true',  # specify that we handle shared drives
+            'corpora': 'drive',  # used for handling shared drives
+            'driveId': self.__env['DRIVE_ID']
+        }
+
+        nodes: list[Node] = []
+        pageToken = None
+        # iterate over pages
+        while True:
+            params = dict(QUERY_PARAMS)
+            if pageToken is not None:
+                params['pageToken'] = pageToken
+            response = await self.__request('/files', params, lambda r: r.json())
+
+            # see `GoogleDriveApi.getFolderContent`
+            if response.get('incompleteSearch'):
+                print("incomplete search, continuing")
+
+            for node in response.get('files', []):
+                if node['mimeType'] != GoogleDriveApi.MIME_TYPE_FOLDER:
+                    node['size'] = int(node['size'])
+                nodes.append(node)
+
+            pageToken = response.get('nextPageToken', None)
+            if pageToken is None:
+                break
+
+        return nodes
+
+    async def __aenter__(self) -> 'GoogleDriveApiAsync':
+        self.__session = aiohttp.ClientSession()
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.__session.close()
+
+    def __init__(self, env: Env, credentials: Credentials) -> None:
+        """
+        @param env: Environment, `DRIVE_API_URL` can point to a local stub for testing.
+        @param credentials: Credentials, usually shared with `GoogleDriveApi`.
+        """
+        self.__env = env
+        self.__credentials = credentials
+        self.__baseUrl = env.get('DRIVE_API_URL', 'https://www.googleapis.com/drive/v3')
+        self.__semaphore = asyncio.Semaphore(env.get('DRIVE_CONCURRENCY', 8))
+        self.__refreshLock = asyncio.Lock()
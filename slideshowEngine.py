@@ -0,0 +1,566 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import time
+import pathlib
+import random
+import collections
+import shutil
+import json
+import argparse
+import threading
+import concurrent.futures
+import cv2
+from colorama import Fore, Back, Style
+from dotenv import load_dotenv
+from typing import Iterator, TypedDict
+from PIL import Image, UnidentifiedImageError, ImageFile
+from pillow_heif import register_heif_opener
+from googleapiclient.errors import HttpError
+from fileSystem import FileSystem, Folder, File
+from envType import Env
+
+
+class Slide(TypedDict):
+    """ A slide that is ready to be displayed. """
+    file: File
+    path: str  # path of the file relative to the root folder
+    pathLocal: str  # path of the downloaded file on disk, None if rendered from cache
+    caption: str
+    isVideo: bool
+    image: Image.Image  # rendered to display size, None for videos
+    fps: float  # 0 for images
+    duration: float  # video length in seconds, 0 for images
+
+
+def readEnv(daemon=False) -> Env:
+    """
+    Read the environment from `.env` and the process environment.
+
+    @param daemon: Read it for `cacheDaemon.py`, which serves every root
+        folder and shows no slides itself. `ROOT_FOLDER_ID` and
+        `SLIDESHOW_SPEED` are optional then.
+    """
+    load_dotenv()
+    slideshowSpeed = os.getenv('SLIDESHOW_SPEED')
+    env = {
+        'DRIVE_ID': os.getenv('DRIVE_ID'),
+        'ROOT_FOLDER_ID': os.getenv('ROOT_FOLDER_ID'),
+        'CREDENTIALS_FILE': os.getenv('CREDENTIALS_FILE'),
+        'TOKEN_FILE': os.getenv('TOKEN_FILE', 'token.json'),
+        # SLIDESHOW_SPEED seconds
+        'SLIDESHOW_SPEED': int(slideshowSpeed)*1000 if slideshowSpeed else None,
+        # CACHE_RETENTION hours
+        'CACHE_RETENTION': int(os.getenv('CACHE_RETENTION', 30)),
+        'CACHE_FILE': os.getenv('CACHE_FILE', 'cache.json'),
+        'PICTURE_TEMP_FOLDER': os.path.realpath(os.getenv('PICTURE_TEMP_FOLDER', 'temp')),
+        'PICTURE_KEEP_NR': int(os.getenv('PICTURE_KEEP_NR', 10)),
+        # MAX_FILE_SIZE in MB, -1 to disable
+        'MAX_FILE_SIZE': int(os.getenv('MAX_FILE_SIZE', -1))*1_000_000,
+        # MAX_VIDEO_LENGTH in minutes, -1 to disable all videos
+        'MAX_VIDEO_LENGTH': int(os.getenv('MAX_VIDEO_LENGTH', -1)) * 60,
+        # parallel requests when crawling and prefetching
+        'DRIVE_CONCURRENCY': int(os.getenv('DRIVE_CONCURRENCY', 8)),
+        'DRIVE_API_URL': os.getenv('DRIVE_API_URL', 'https://www.googleapis.com/drive/v3'),
+        # INDEX_REFRESH minutes, how often new files are looked for
+        'INDEX_REFRESH': int(os.getenv('INDEX_REFRESH', 60)) * 60,
+        # number of rendered images kept in memory
+        'DERIVATIVE_CACHE_NR': int(os.getenv('DERIVATIVE_CACHE_NR', 20)),
+        # get slides from a running `cacheDaemon.py` instead of Google Drive
+        'CACHE_SERVER_URL': os.getenv('CACHE_SERVER_URL'),
+        'CACHE_SERVER_PORT': int(os.getenv('CACHE_SERVER_PORT', 8730)),
+    }
+
+    # validate tempFolder
+    programPath = os.path.realpath(os.path.dirname(__file__))
+    if not pathlib.Path(env['PICTURE_TEMP_FOLDER']).is_relative_to(programPath):
+        # Tempfolder is outside of program directory.
+        # Since we erase its contents, this is dangerous.
+        # Abort.
+        print(
+            Fore.RED + 'PICTURE_TEMP_FOLDER must be inside program directory.' + Style.RESET_ALL)
+        exit(1)
+
+    # ensure mandatory args are present
+    if daemon:
+        valid = env['DRIVE_ID'] and env['CREDENTIALS_FILE']
+    else:
+        # clients of the cache daemon don't access Google Drive themselves
+        valid = env['ROOT_FOLDER_ID'] and env['SLIDESHOW_SPEED'] is not None and (
+            env['CACHE_SERVER_URL'] or (env['DRIVE_ID'] and env['CREDENTIALS_FILE']))
+    if valid:
+        return env
+    else:
+        raise ValueError(
+            'Environment variables are invalid. Check your `.env`.')
+
+
+def readVideoFrames(pathLocal: str, width: int, height: int) -> Iterator[Image.Image]:
+    """ Decode the frames of a video on disk, resized to fit into width x height. """
+    video = cv2.VideoCapture(pathLocal)
+    try:
+        while True:
+            ret, frame = video.read()
+            if not ret:
+                return
+            original_height, original_width = frame.shape[:2]
+
+            # Calculate the scaling factor
+            scaling_factor = min(width / original_width, height / original_height)
+
+            # Resize the frame while preserving aspect ratio
+            new_width = int(original_width * scaling_factor)
+            new_height = int(original_height * scaling_factor)
+
+            # Resize the frame using OpenCV
+            frame = cv2.resize(frame, (new_width, new_height))
+            yield Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    finally:
+        video.release()
+
+
+class SlideshowEngine:
+    """
+    Selects, downloads and renders slides without any GUI.
+    The Tk slideshow is just one consumer of `slides()`, the headless export
+    mode (see `exportSlides`) is another.
+    """
+
+    __env: Env
+    __rootFolder: Folder
+    __fileSystem: FileSystem
+
+    __log: collections.deque[File]
+    # guards the state below, may be shared with other engines
+    __lock: threading.Lock
+
+    __width: int
+    __height: int
+
+    # rendered images, keyed by content and display size, least recently used first
+    __derivatives: collections.OrderedDict[tuple[str, int, int], Image.Image]
+
+    # unique files below every top level folder, with their paths,
+    # rebuilt every INDEX_REFRESH seconds
+    __index: dict[str, list[tuple[File, str]]]
+    __photoDistribution: dict
+    __sum: int
+    __indexTime: float
+    __rebuilding: bool
+
+    # next picture and its download running in the background while the
+    # current one is shown
+    __upcoming: tuple[File, str, concurrent.futures.Future]
+    __prefetchExecutor: concurrent.futures.ThreadPoolExecutor
+
+    SUPPORTED_IMAGE_MIME_TYPES = [
+        'image/jpeg',
+        'image/png',
+        'image/heif',
+        'image/x-photoshop',
+        'image/cr2',
+        'video/mp4',
+        'video/mpeg',
+        'video/quicktime',
+        'video/x-ms-wmv',
+        'video/x-msvideo',
+    ]
+
+    VIDEO_TYPES = [
+        'video/mp4',
+        'video/mpeg',
+        'video/quicktime',
+        'video/x-msvideo',
+    ]
+
+
+    def __createPhotoDistribution(self, rootFolder: Folder, index: dict) -> dict:
+        '''
+        Builds a dictionary of every top level folder in the root folder
+        This distribution is then used to select a photo or video where
+        folders with more files is selected more often.
+        Only files that can be shown are counted, files with the same content
+        only once, see `FileSystem.indexFolder`.
+        The unique files of every top level folder are put into index.
+        '''
+        dist = dict()
+        graph = dict()
+        seen = set()
+        for nextNode in self.__fileSystem.filterNodes(rootFolder['nodes'], True, False):
+            nextFolder = self.__fileSystem.getFolder(nextNode)
+            index[nextFolder['id']] = self.__fileSystem.indexFolder(
+                nextFolder, nextFolder['name'], seen, self.__isShowable)
+            dist[nextFolder['id']] = len(index[nextFolder['id']])
+            graph[nextFolder['name']] = dist[nextFolder['id']]
+        print(graph)
+        return dict(sorted(dist.items(), key=lambda item: item[1]))
+
+    def __rebuildIndex(self) -> None:
+        """
+        Crawl the tree and rebuild index and distribution from it.
+        Folders whose cache entry expired are fetched again, this is how new
+        files show up. The lock is only held to swap in the result.
+        """
+        # HACK: Get root folder from ID only.
+        rootFolder = self.__fileSystem.getFolder(
+            Folder(id=self.__env['ROOT_FOLDER_ID'], name="", nrFolders=-1, nrFiles=-1, nodes=[]))
+        # The distribution visits every folder anyway, crawl them concurrently
+        # first so it is computed from cache.
+        self.__fileSystem.forceInitialize(rootFolder)
+        index = {}
+        photoDistribution = self.__createPhotoDistribution(rootFolder, index)
+        with self.__lock:
+            self.__rootFolder = rootFolder
+            self.__index = index
+            self.__photoDistribution = photoDistribution
+            # Calculate the total sum of the valid values
+            self.__sum = sum(photoDistribution.values())
+            self.__indexTime = time.monotonic()
+
+    def __rebuildIndexInBackground(self) -> None:
+        try:
+            self.__rebuildIndex()
+        except Exception as e:
+            # keep showing the old index, try again after the next interval
+            print(Fore.RED + f'index: rebuild failed ({e!r})' + Style.RESET_ALL)
+            with self.__lock:
+                self.__indexTime = time.monotonic()
+        finally:
+            with self.__lock:
+                self.__rebuilding = False
+
+    def __isShowable(self, file: File) -> bool:
+        """ Whether file is supported and not too large. """
+        return file['mimeType'] in self.SUPPORTED_IMAGE_MIME_TYPES and (
+            self.__env['MAX_FILE_SIZE'] == -1 or self.__env['MAX_FILE_SIZE'] > file['size'])
+
+    def __getRandomPhotoDict(self) -> tuple[str, int]:
+        # Generate a random number between 0 and total_sum
+        random_number = random.randint(0, self.__sum - 1)
+        # Iterate through the dictionary and find where the random number lies
+        cumulative_sum = 0
+        for key, value in self.__photoDistribution.items():
+            cumulative_sum += value
+            if random_number < cumulative_sum:
+                return (key, random_number)
+        pass
+
+    def __chooseRandomFile(self) -> tuple[File, str]:
+        # Show folders with more pictures more often
+        r = self.__getRandomPhotoDict()
+        return random.choice(self.__index[r[0]])
+
+    def __choosePicture(self) -> tuple[File, str]:
+        """
+        Choose a random picture. The index only contains pictures that are
+        supported and not too large.
+
+        @return File and path to file.
+        """
+        if self.__sum == 0:
+            raise RuntimeError('No supported pictures below the root folder.')
+        return self.__chooseRandomFile()
+
+    def __takePicture(self, width: int, height: int, prefetchNext: bool) -> tuple[File, str, concurrent.futures.Future]:
+        """
+        Take the picture chosen ahead of time, choose the one after and start
+        downloading it in the background while the current one is shown.
+        It is not downloaded if it is rendered to width x height already.
+
+        @param prefetchNext: Choose and download the one after.
+        @return File, path to file and its download, which may be None.
+        """
+        with self.__lock:
+            if not self.__rebuilding and time.monotonic() - self.__indexTime > self.__env['INDEX_REFRESH']:
+                self.__rebuilding = True
+                threading.Thread(target=self.__rebuildIndexInBackground, daemon=True).start()
+            if self.__upcoming is None:
+                self.__upcoming = (*self.__choosePicture(), None)
+            current = self.__upcoming
+            self.__upcoming = None
+            if not prefetchNext:
+                return current
+            nextFile, nextPath = self.__choosePicture()
+            if (FileSystem.contentKey(nextFile), width, height) in self.__derivatives:
+                self.__upcoming = (nextFile, nextPath, None)
+            else:
+                self.__upcoming = (nextFile, nextPath, self.__prefetchExecutor.submit(
+                    self.__fileSystem.prefetchFiles, [nextFile]))
+            return current
+
+    def __download(self, file: File, prefetch: concurrent.futures.Future) -> str:
+        """ @return Path to file on disk. """
+        if prefetch is not None:
+            try:
+                prefetch.result()
+            except Exception as e:
+                # getFile below downloads it again or reports the error
+                print(f'prefetch: failed ({e!r})')
+        return self.__fileSystem.getFile(file)
+
+    def __logShown(self, file: File, path: str) -> None:
+        """ Remember file as shown, delete the download of the least recent one. """
+        oldFile = None
+        with self.__lock:
+            self.__log.append(file)
+            if len(self.__log) == self.__log.maxlen:
+                oldFile = self.__log.popleft()
+            self.__logToFile(file, path)
+        # outside the lock, deleting waits for a running download of the same content
+        if oldFile is not None:
+            self.__fileSystem.deleteFile(oldFile)
+
+    def __logToFile(self, file: File, path: str) -> None:
+        with open(os.path.join(self.__env['PICTURE_TEMP_FOLDER'], 'log.txt'), 'a') as f:
+            f.write(json.dumps({
+                'id': file['id'],
+                'path': path,
+            }, check_circular=False))
+            f.write(f',{os.linesep}')
+
+    def __resize(self, pilImage, width: int, height: int):
+        # resize image to full screen size
+        imgWidth, imgHeight = pilImage.size
+        # The .load() call is not necessary, but a workaround for
+        # Pillow bug #6185 which causes issues during resizing.
+        # error caused: ValueError: box can't exceed original image size
+        # https://github.com/python-pillow/Pillow/issues/6185
+        pilImage.load()
+        ratio = min(width/imgWidth,
+                    height/imgHeight)
+        imgWidthFull = int(imgWidth*ratio)
+        imgHeightFull = int(imgHeight*ratio)
+        return pilImage.resize(
+            (imgWidthFull, imgHeightFull), Image.LANCZOS)
+
+    def __cachedRender(self, file: File, width: int, height: int) -> Image.Image:
+        """ @return Image rendered to width x height before, or None. """
+        key = (FileSystem.contentKey(file), width, height)
+        with self.__lock:
+            pilImage = self.__derivatives.get(key, None)
+            if pilImage is not None:
+                self.__derivatives.move_to_end(key)
+            return pilImage
+
+    def __render(self, file: File, pathLocal: str, width: int, height: int) -> Image.Image:
+        """ Render image to width x height and put it into the derivative cache. """
+        pilImage = self.__resize(Image.open(pathLocal), width, height)
+        with self.__lock:
+            self.__derivatives[(FileSystem.contentKey(file), width, height)] = pilImage
+            if len(self.__derivatives) > self.__env['DERIVATIVE_CACHE_NR']:
+                self.__derivatives.popitem(last=False)
+        return pilImage
+
+    @property
+    def env(self) -> Env:
+        return self.__env
+
+    def setDisplaySize(self, width: int, height: int) -> None:
+        """ Set the size the next slides are rendered to. """
+        self.__width = width
+        self.__height = height
+
+    def nextSlide(self, width: int = None, height: int = None, prefetchNext=True) -> Slide:
+        """
+        Choose, download and render the next slide.
+        Unsupported, corrupted or too long files are skipped.
+        Images still in the derivative cache are not downloaded again.
+        Thread safe, downloading and rendering run concurrently.
+
+        @param width: Render width, defaults to the display size.
+        @param height: Render height, defaults to the display size.
+        @param prefetchNext: Choose and download the following slide in the
+            background. Disable for the last slide.
+        """
+        width = self.__width if width is None else width
+        height = self.__height if height is None else height
+        errors = 0
+        while True:
+            print('Get next slide')
+            file, path, prefetch = self.__takePicture(width, height, prefetchNext)
+            print(f"Got next slide: '{path}'")
+            caption = " ".join(str(path).split('/')[:-1])
+            isVideo = file['mimeType'] in self.VIDEO_TYPES
+
+            pilImage = None if isVideo else self.__cachedRender(file, width, height)
+            pathLocal = None
+            if pilImage is None:
+                try:
+                    pathLocal = self.__download(file, prefetch)
+                except HttpError as e:
+                    if e.status_code != 404:
+                        raise e
+                    # file not found, probably stale cache
+                    print('404 error, probably a stale cache entry?')
+                    errors += 1
+                    if errors >= 10:
+                        raise RuntimeError('Choosing a random picture failed too many times.')
+                    continue
+            self.__logShown(file, path)
+
+            if isVideo:
+                video = cv2.VideoCapture(pathLocal)
+                fps = video.get(cv2.CAP_PROP_FPS)
+                frame_count = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+                video.release()
+                duration = frame_count/fps if fps > 0 else 0
+                max_duration = self.__env['MAX_VIDEO_LENGTH']
+
+                if duration > max_duration:
+                    print(f'Video length was too long, expected {max_duration}, received {duration}')
+                    continue
+                return Slide(file=file, path=path, pathLocal=pathLocal, caption=caption,
+                             isVideo=True, image=None, fps=fps, duration=duration)
+
+            if pilImage is None:
+                try:
+                    pilImage = self.__render(file, pathLocal, width, height)
+                except (UnidentifiedImageError, OSError):
+                    # image is unsupported or corrupted
+                    # try again
+                    continue
+            return Slide(file=file, path=path, pathLocal=pathLocal, caption=caption,
+                         isVideo=False, image=pilImage, fps=0, duration=0)
+
+    def slides(self) -> Iterator[Slide]:
+        """ Endless stream of ready-to-display slides. """
+        while True:
+            yield self.nextSlide()
+
+    def videoFrames(self, slide: Slide) -> Iterator[Image.Image]:
+        """ Decode the frames of a video slide, rendered to display size. """
+        return readVideoFrames(slide['pathLocal'], self.__width, self.__height)
+
+    def __init__(self, env: Env, width: int, height: int, fileSystem: FileSystem = None,
+                 log: collections.deque = None, derivatives: collections.OrderedDict = None,
+                 lock: threading.Lock = None) -> None:
+        """
+        @param env: Environment, see `readEnv`.
+        @param width: Render width, see `setDisplaySize`.
+        @param height: Render height, see `setDisplaySize`.
+        @param fileSystem: Share folder index and media cache with other engines.
+            The temp folder is only reset if the engine creates its own.
+        @param log: Recently shown files, share to evict downloads across engines.
+        @param derivatives: Rendered images, share to reuse them across engines.
+        @param lock: Guards log and derivatives, share together with them.
+        """
+        ImageFile.LOAD_TRUNCATED_IMAGES = True
+        self.__env = env
+        self.__width = width
+        self.__height = height
+        register_heif_opener()
+        ownFileSystem = fileSystem is None
+        self.__fileSystem = FileSystem(self.__env) if ownFileSystem else fileSystem
+
+        self.__log = collections.deque(maxlen=self.__env['PICTURE_KEEP_NR']) if log is None else log
+        self.__derivatives = collections.OrderedDict() if derivatives is None else derivatives
+        self.__lock = threading.Lock() if lock is None else lock
+        self.__upcoming = None
+        self.__prefetchExecutor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.__rebuilding = False
+        self.__rebuildIndex()
+
+        if ownFileSystem:
+            # clear and generate temp folder
+            tempFolder = self.__env['PICTURE_TEMP_FOLDER']
+            if os.path.exists(tempFolder):
+                shutil.rmtree(tempFolder)
+            os.makedirs(tempFolder)
+
+
+def _writeAtomic(image: Image.Image, path: str, metadata: dict) -> None:
+    """
+    Write image and its metadata such that readers never see a partially
+    written frame. The metadata is written next to the image as `<path>.json`.
+
+    Both files are replaced one after the other, not together. The metadata
+    goes first, so it may briefly describe the next frame while the previous
+    image is still in place, but a new image is never paired with old metadata.
+    """
+    with open(path + '.json.tmp', 'w') as f:
+        json.dump(metadata, f)
+    _, extension = os.path.splitext(path)
+    tmpPath = path + '.tmp' + extension
+    image.convert('RGB').save(tmpPath)
+    os.replace(path + '.json.tmp', path + '.json')
+    os.replace(tmpPath, path)
+
+
+def exportSlides(engine: 'SlideshowEngine | CacheDaemonClient', outputDir: str = None, framebuffer: str = None,
+                 count: int = -1, interval: float = 0) -> None:
+    """
+    Render slides without a display.
+
+    @param engine: Source of the slides.
+    @param outputDir: Write every slide as a numbered file into this directory,
+        metadata is appended to `slides.jsonl` in the same directory.
+        Numbering continues after the slides already listed there.
+    @param framebuffer: Overwrite this single file with the current slide.
+    @param count: Number of slides to render, -1 for endless.
+    @param interval: Seconds to wait between two slides.
+    """
+    # number of the first slide written by this run
+    first = 0
+    if outputDir is not None:
+        os.makedirs(outputDir, exist_ok=True)
+        if os.path.exists(os.path.join(outputDir, 'slides.jsonl')):
+            with open(os.path.join(outputDir, 'slides.jsonl'), 'r') as f:
+                first = sum(1 for line in f if line.strip())
+    written = 0
+    while count == -1 or written < count:
+        # don't choose and download a slide after the last one
+        slide = engine.nextSlide(prefetchNext=count == -1 or written + 1 < count)
+        # videos are exported as their first frame
+        image = slide['image']
+        if slide['isVideo']:
+            image = next(engine.videoFrames(slide), None)
+            if image is None:
+                continue
+        metadata = {
+            'id': slide['file']['id'],
+            'path': slide['path'],
+            'mimeType': slide['file']['mimeType'],
+            'caption': slide['caption'],
+            'isVideo': slide['isVideo'],
+            'width': image.width,
+            'height': image.height,
+        }
+        if outputDir is not None:
+            name = f'slide-{first + written:06d}.jpg'
+            image.convert('RGB').save(os.path.join(outputDir, name))
+            with open(os.path.join(outputDir, 'slides.jsonl'), 'a') as f:
+                f.write(json.dumps({'file': name, **metadata}) + os.linesep)
+        if framebuffer is not None:
+            _writeAtomic(image, framebuffer, metadata)
+        print(f"export: '{slide['path']}'")
+        written += 1
+        if interval > 0:
+            time.sleep(interval)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render slides without a display.')
+    parser.add_argument('--output-dir', help='directory to write every rendered slide to')
+    parser.add_argument('--framebuffer', help='single file that is overwritten with the current slide')
+    parser.add_argument('--count', type=int, default=-1, help='number of slides, -1 for endless')
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--interval', type=float, default=None,
+                        help='seconds between slides, defaults to SLIDESHOW_SPEED for --framebuffer and 0 otherwise')
+    args = parser.parse_args()
+    if args.output_dir is None and args.framebuffer is None:
+        parser.error('at least one of --output-dir and --framebuffer is required')
+
+    env = readEnv()
+    interval = args.interval
+    if interval is None:
+        interval = env['SLIDESHOW_SPEED'] / 1000 if args.framebuffer is not None else 0
+    if env['CACHE_SERVER_URL']:
+        # cacheDaemon imports this module
+        from cacheDaemon import CacheDaemonClient
+        engine = CacheDaemonClient(env, args.width, args.height)
+    else:
+        engine = SlideshowEngine(env, args.width, args.height)
+    exportSlides(engine, args.output_dir, args.framebuffer, args.count, interval)
+    sys.exit(0)
@@ -0,0 +1,81 @@
+""" Tests for `FileSystem` against the local Drive stub, see `conftest.py`. """
+import os
+import pytest
+from conftest import TREE, DriveStub, FakeCredentials, FakeGoogleDriveApi, folderNode
+from fileSystem import FileSystem
+
+
+@pytest.fixture
+def syncApi() -> FakeGoogleDriveApi:
+    return FakeGoogleDriveApi(FakeCredentials('token-0'))
+
+
+@pytest.fixture
+def fileSystem(drive: DriveStub, syncApi: FakeGoogleDriveApi, tmp_path) -> FileSystem:
+    env = drive.env(
+        CACHE_FILE=str(tmp_path / 'cache.json'),
+        CACHE_RETENTION=24,
+        PICTURE_TEMP_FOLDER=str(tmp_path),
+    )
+    return FileSystem(env, syncApi)
+
+
+def folders(fileSystem: FileSystem) -> dict:
+    """ Folder ID -> cached node IDs, read through `getFolder`. """
+    return {folderId: [node['id'] for node in fileSystem.getFolder(folderNode(folderId))['nodes']]
+            for folderId in TREE}
+
+
+def test_forceInitialize(drive, syncApi, fileSystem):
+    fileSystem.forceInitialize(fileSystem.getFolder(folderNode('root')))
+    assert sorted(set(drive.folderRequests)) == ['A', 'B', 'C']
+    # everything is served from cache now
+    assert folders(fileSystem) == {folderId: [node['id'] for node in nodes]
+                                   for folderId, nodes in TREE.items()}
+    assert drive.folderRequests.count('A') == 1
+    assert syncApi.folderRequests == ['root']
+
+
+def test_forceInitializeSkipsFailedFolder(drive, fileSystem):
+    drive.broken = {'A'}
+    fileSystem.forceInitialize(fileSystem.getFolder(folderNode('root')))
+    # 'C' is below the failed folder, 'B' is crawled anyway
+    assert 'B' in drive.folderRequests
+    assert 'C' not in drive.folderRequests
+    assert [node['id'] for node in fileSystem.getFolder(folderNode('B'))['nodes']] == ['b1', 'b2']
+
+
+def test_prefetchFiles(drive, fileSystem, tmp_path):
+    files = [dict(TREE['A'][0]), dict(TREE['B'][0]), dict(TREE['B'][1])]
+    paths = fileSystem.prefetchFiles(files)
+    # 'a1' and 'b1' have the same content and share one download
+    assert paths[0] == paths[1] == str(tmp_path / 'h1.jpg')
+    assert paths[2] == str(tmp_path / 'h3.jpg')
+    assert len(drive.downloads) == 2
+    with open(paths[2], 'rb') as f:
+        assert f.read() == b'content-b2'
+    # files on disk are not downloaded again
+    assert fileSystem.prefetchFiles(files) == paths
+    assert len(drive.downloads) == 2
+    assert not any(name.endswith('.part') for name in os.listdir(tmp_path))
+
+
+def test_contentKey():
+    assert FileSystem.contentKey(TREE['A'][0]) == 'h1'
+    # e.g. Google Docs have no checksum
+    assert FileSystem.contentKey({'id': 'doc', 'name': 'doc', 'mimeType': 'application/vnd.google-apps.document'}) == 'doc'
+
+
+def test_indexFolder(fileSystem):
+    def accept(file):
+        return file['mimeType'].startswith('image/') and file['size'] < 1_000_000
+
+    seen = set()
+    # every top level folder is indexed on its own, sharing what was seen
+    indexA = fileSystem.indexFolder(fileSystem.getFolder(folderNode('A')), 'A', seen, accept)
+    indexB = fileSystem.indexFolder(fileSystem.getFolder(folderNode('B')), 'B', seen, accept)
+    assert [path for _, path in indexA] == ['A/a1.jpg', 'A/C/c1.png']
+    # 'b1' is a copy of 'a1'
+    assert [path for _, path in indexB] == ['B/b2.jpg']
+    assert seen == {'h1', 'h2', 'h3'}
+    assert len(fileSystem.indexFolder(fileSystem.getFolder(folderNode('C')), 'C', set())) == 3
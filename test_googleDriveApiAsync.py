@@ -0,0 +1,78 @@
+""" Tests for `GoogleDriveApiAsync` against the local Drive stub, see `conftest.py`. """
+import asyncio
+import aiohttp
+import pytest
+from conftest import DriveStub, FakeCredentials
+from googleDriveApiAsync import GoogleDriveApiAsync
+
+
+def run(drive: DriveStub, credentials: FakeCredentials, test) -> any:
+    """ Run `test(api)` against the stub. """
+    async def main():
+        async with GoogleDriveApiAsync(drive.env(), credentials) as api:
+            return await test(api)
+    return asyncio.run(main())
+
+
+def test_getFolderContent(drive):
+    nodes = run(drive, FakeCredentials('token-0'), lambda api: api.getFolderContent('A'))
+    assert [node['id'] for node in nodes] == ['a1', 'C']
+    assert nodes[0]['size'] == 3
+    assert 'size' not in nodes[1]
+
+
+def test_getFolderContentPagination(drive, monkeypatch):
+    monkeypatch.setattr(DriveStub, 'PAGE_SIZE', 1)
+    nodes = run(drive, FakeCredentials('token-0'), lambda api: api.getFolderContent('B'))
+    assert [node['id'] for node in nodes] == ['b1', 'b2']
+    assert drive.folderRequests == ['B', 'B']
+
+
+@pytest.mark.parametrize('status, reason', [
+    (429, 'rateLimitExceeded'),
+    (500, 'backendError'),
+    (503, 'backendError'),
+    (403, 'userRateLimitExceeded'),
+    (403, 'rateLimitExceeded'),
+])
+def test_retry(drive, status, reason):
+    drive.failures = [(status, reason), (status, reason)]
+    node = run(drive, FakeCredentials('token-0'), lambda api: api.getNode('x'))
+    assert node['id'] == 'x'
+    assert drive.requests == 3
+
+
+def test_noRetryOnForbidden(drive):
+    drive.failures = [(403, 'insufficientFilePermissions')]
+    with pytest.raises(aiohttp.ClientResponseError) as error:
+        run(drive, FakeCredentials('token-0'), lambda api: api.getNode('x'))
+    assert error.value.status == 403
+    assert drive.requests == 1
+
+
+def test_retryGivesUp(drive):
+    drive.failures = [(503, 'backendError')] * (GoogleDriveApiAsync.MAX_RETRIES + 1)
+    with pytest.raises(aiohttp.ClientResponseError) as error:
+        run(drive, FakeCredentials('token-0'), lambda api: api.getNode('x'))
+    assert error.value.status == 503
+    assert drive.requests == GoogleDriveApiAsync.MAX_RETRIES + 1
+
+
+def test_refreshOnceForConcurrent401(drive):
+    drive.validToken = 'token-1'
+    credentials = FakeCredentials('expired')
+
+    async def test(api):
+        return await asyncio.gather(*(api.getNode(str(i)) for i in range(5)))
+
+    nodes = run(drive, credentials, test)
+    assert [node['id'] for node in nodes] == [str(i) for i in range(5)]
+    assert credentials.refreshes == 1
+
+
+def test_downloadFile(drive, tmp_path):
+    path = str(tmp_path / 'a1.jpg')
+    run(drive, FakeCredentials('token-0'), lambda api: api.downloadFile('a1', path))
+    with open(path, 'rb') as f:
+        assert f.read() == b'content-a1'
+    assert not (tmp_path / 'a1.jpg.part').exists()